@@ -1,32 +1,119 @@
+import os
 import sqlite3
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Одна база на все боты процесса, записи разделяются по bot_id
+DB_PATH = os.getenv('DB_PATH', 'reminders.db')
+
+def get_connection():
+    return sqlite3.connect(DB_PATH)
+
 def init_db():
     try:
         logger.info("Initializing database...")
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
+        # WAL позволяет читать базу во время записи рассылок других ботов
+        c.execute('PRAGMA journal_mode=WAL')
         c.execute('''
             CREATE TABLE IF NOT EXISTS reminders (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot_id INTEGER NOT NULL DEFAULT 0,
                 user_id INTEGER NOT NULL,
                 text TEXT NOT NULL,
                 reminder_time TIMESTAMP NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_sent BOOLEAN DEFAULT 0
+                is_sent BOOLEAN DEFAULT 0,
+                media_type TEXT,
+                media_file_id TEXT,
+                progress_user_id INTEGER DEFAULT 0
             )
         ''')
+        # Миграция старых баз без колонок для вложений и прогресса рассылки
+        add_column_if_missing(c, 'reminders', 'media_type', 'TEXT')
+        add_column_if_missing(c, 'reminders', 'media_file_id', 'TEXT')
+        add_column_if_missing(c, 'reminders', 'progress_user_id', 'INTEGER DEFAULT 0')
+        add_column_if_missing(c, 'reminders', 'bot_id', 'INTEGER NOT NULL DEFAULT 0')
+        migrate_users_table(c)
         c.execute('''
             CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
+                bot_id INTEGER NOT NULL DEFAULT 0,
+                user_id INTEGER NOT NULL,
                 username TEXT,
                 first_name TEXT,
                 last_name TEXT,
-                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                quiet_hours TEXT,
+                PRIMARY KEY (bot_id, user_id)
+            )
+        ''')
+        # quiet_hours: NULL - общие тихие часы, '' - отключены, 'ЧЧ:ММ-ЧЧ:ММ' - свои
+        add_column_if_missing(c, 'users', 'quiet_hours', 'TEXT')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders (is_sent, reminder_time)')
+        # Очередь повторной отправки: хранит готовый текст сообщения, так как
+        # само напоминание удаляется после основной рассылки
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS retry_queue (
+                reminder_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                bot_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                media_type TEXT,
+                media_file_id TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL,
+                last_error TEXT,
+                PRIMARY KEY (reminder_id, user_id)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_retry_queue_next_attempt ON retry_queue (next_attempt_at)')
+        # Отложенные из-за тихих часов доставки
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS deferred_queue (
+                reminder_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                bot_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                media_type TEXT,
+                media_file_id TEXT,
+                release_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (reminder_id, user_id)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_deferred_queue_release ON deferred_queue (release_at)')
+        # Статистика доставки по напоминанию. Обновляется пачками во время
+        # рассылки и переживает удаление самого напоминания
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_stats (
+                reminder_id INTEGER PRIMARY KEY,
+                bot_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                reminder_time TIMESTAMP NOT NULL,
+                targeted INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                deferred INTEGER NOT NULL DEFAULT 0,
+                retrying INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                first_sent_at TIMESTAMP,
+                last_sent_at TIMESTAMP
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_reminder_stats_owner ON reminder_stats (bot_id, user_id)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_failures (
+                reminder_id INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (reminder_id, reason)
             )
         ''')
         conn.commit()
@@ -36,15 +123,70 @@ def init_db():
         logger.error(f"Error initializing database: {e}")
         raise
 
-def add_or_update_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+def add_column_if_missing(cursor, table: str, column: str, definition: str):
+    cursor.execute(f'PRAGMA table_info({table})')
+    columns = [row[1] for row in cursor.fetchall()]
+    if column not in columns:
+        logger.info(f"Adding column {column} to table {table}")
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def migrate_users_table(cursor):
+    # В старых базах users без bot_id с первичным ключом только по user_id:
+    # пересоздаем таблицу с составным ключом, bot_id = 0 до claim_legacy_rows
+    cursor.execute('PRAGMA table_info(users)')
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns or 'bot_id' in columns:
+        return
+    logger.info("Migrating users table to per-bot primary key")
+    cursor.execute('ALTER TABLE users RENAME TO users_old')
+    cursor.execute('''
+        CREATE TABLE users (
+            bot_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot_id, user_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO users (bot_id, user_id, username, first_name, last_name, last_interaction)
+        SELECT 0, user_id, username, first_name, last_name, last_interaction FROM users_old
+    ''')
+    cursor.execute('DROP TABLE users_old')
+
+def claim_legacy_rows(bot_id: int):
+    # Записи, созданные до появления нескольких ботов, принадлежат основному боту
     try:
-        logger.info(f"Adding/updating user {user_id} to database")
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
+        c.execute('UPDATE reminders SET bot_id = ? WHERE bot_id = 0', (bot_id,))
+        reminders = c.rowcount
+        c.execute('UPDATE OR IGNORE users SET bot_id = ? WHERE bot_id = 0', (bot_id,))
+        users = c.rowcount
+        conn.commit()
+        conn.close()
+        if reminders or users:
+            logger.info(f"Assigned {reminders} legacy reminders and {users} users to bot {bot_id}")
+    except Exception as e:
+        logger.error(f"Error assigning legacy rows to bot {bot_id}: {e}")
+
+def add_or_update_user(bot_id: int, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+    try:
+        logger.info(f"Adding/updating user {user_id} of bot {bot_id} to database")
+        conn = get_connection()
+        c = conn.cursor()
+        # Не INSERT OR REPLACE: замена строки сбросила бы настройки пользователя
         c.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, last_interaction)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (user_id, username, first_name, last_name))
+            INSERT INTO users (bot_id, user_id, username, first_name, last_name, last_interaction)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (bot_id, user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                last_interaction = excluded.last_interaction
+        ''', (bot_id, user_id, username, first_name, last_name))
         conn.commit()
         conn.close()
         logger.info(f"Successfully added/updated user {user_id}")
@@ -53,12 +195,13 @@ def add_or_update_user(user_id: int, username: str = None, first_name: str = Non
         logger.error(f"Error adding/updating user {user_id}: {e}")
         return False
 
-def get_all_users():
+def get_all_users(bot_id: int):
     try:
-        logger.info("Getting all users from database")
-        conn = sqlite3.connect('reminders.db')
+        logger.info(f"Getting all users of bot {bot_id} from database")
+        conn = get_connection()
         c = conn.cursor()
-        c.execute('SELECT user_id FROM users')
+        # Порядок по user_id нужен для возобновления рассылки с контрольной точки
+        c.execute('SELECT user_id FROM users WHERE bot_id = ? ORDER BY user_id', (bot_id,))
         users = c.fetchall()
         conn.close()
         user_ids = [user[0] for user in users]
@@ -68,14 +211,65 @@ def get_all_users():
         logger.error(f"Error getting users: {e}")
         return []
 
-def add_reminder(user_id: int, text: str, reminder_time: datetime) -> int:
+def count_users(bot_id: int, after_user_id: int = 0) -> int:
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM users WHERE bot_id = ? AND user_id > ?', (bot_id, after_user_id))
+        count = c.fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        logger.error(f"Error counting users of bot {bot_id}: {e}")
+        return 0
+
+def set_user_quiet_hours(bot_id: int, user_id: int, quiet_hours: str = None) -> bool:
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('UPDATE users SET quiet_hours = ? WHERE bot_id = ? AND user_id = ?', (quiet_hours, bot_id, user_id))
+        updated = c.rowcount
+        conn.commit()
+        conn.close()
+        return updated > 0
+    except Exception as e:
+        logger.error(f"Error setting quiet hours for user {user_id} of bot {bot_id}: {e}")
+        return False
+
+def get_user_quiet_hours(bot_id: int, user_id: int):
     try:
-        logger.info(f"Adding reminder for user {user_id}")
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT quiet_hours FROM users WHERE bot_id = ? AND user_id = ?', (bot_id, user_id))
+        row = c.fetchone()
+        conn.close()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error getting quiet hours for user {user_id} of bot {bot_id}: {e}")
+        return None
+
+def get_users_quiet_hours(bot_id: int):
+    # Только пользователи со своими настройками, остальным действуют общие
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT user_id, quiet_hours FROM users WHERE bot_id = ? AND quiet_hours IS NOT NULL', (bot_id,))
+        quiet_hours = dict(c.fetchall())
+        conn.close()
+        return quiet_hours
+    except Exception as e:
+        logger.error(f"Error getting quiet hours of bot {bot_id}: {e}")
+        return {}
+
+def add_reminder(bot_id: int, user_id: int, text: str, reminder_time: datetime,
+                 media_type: str = None, media_file_id: str = None) -> int:
+    try:
+        logger.info(f"Adding reminder for user {user_id} of bot {bot_id}")
+        conn = get_connection()
         c = conn.cursor()
         c.execute(
-            'INSERT INTO reminders (user_id, text, reminder_time) VALUES (?, ?, ?)',
-            (user_id, text, reminder_time.isoformat())
+            'INSERT INTO reminders (bot_id, user_id, text, reminder_time, media_type, media_file_id) VALUES (?, ?, ?, ?, ?, ?)',
+            (bot_id, user_id, text, reminder_time.isoformat(), media_type, media_file_id)
         )
         reminder_id = c.lastrowid
         conn.commit()
@@ -86,16 +280,19 @@ def add_reminder(user_id: int, text: str, reminder_time: datetime) -> int:
         logger.error(f"Error adding reminder: {e}")
         raise
 
-def get_pending_reminders():
+def get_pending_reminders(lookahead: float = 0):
+    # lookahead (секунды) позволяет заранее получить напоминания, рассылку
+    # которых нужно начать до наступления их времени
     try:
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
-        current_time = get_moscow_time().isoformat()
+        current_time = (get_moscow_time() + timedelta(seconds=lookahead)).isoformat()
         logger.info(f"Current time for query: {current_time}")
         c.execute('''
-            SELECT id, user_id, text, reminder_time 
+            SELECT id, user_id, text, reminder_time, media_type, media_file_id, progress_user_id, bot_id
             FROM reminders 
             WHERE is_sent = 0 AND reminder_time <= ?
+            ORDER BY reminder_time ASC
         ''', (current_time,))
         reminders = c.fetchall()
         logger.info(f"Found {len(reminders)} pending reminders in database")
@@ -105,30 +302,52 @@ def get_pending_reminders():
         logger.error(f"Error getting pending reminders: {e}")
         return []
 
-def delete_reminder(reminder_id: int) -> bool:
+def delete_reminder(reminder_id: int, bot_id: int = None) -> bool:
+    # bot_id ограничивает удаление напоминаниями одного бота (для админов)
     try:
         logger.info(f"Deleting reminder {reminder_id}")
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
-        c.execute('DELETE FROM reminders WHERE id = ?', (reminder_id,))
+        if bot_id is None:
+            c.execute('DELETE FROM reminders WHERE id = ?', (reminder_id,))
+        else:
+            c.execute('DELETE FROM reminders WHERE id = ? AND bot_id = ?', (reminder_id, bot_id))
+        deleted = c.rowcount
         conn.commit()
         conn.close()
+        if not deleted:
+            logger.warning(f"Reminder {reminder_id} not found")
+            return False
         logger.info(f"Successfully deleted reminder {reminder_id}")
         return True
     except Exception as e:
         logger.error(f"Error deleting reminder {reminder_id}: {e}")
         return False
 
-def get_user_reminders(user_id: int):
+def save_reminder_progress(reminder_id: int, progress_user_id: int) -> bool:
+    # Контрольная точка рассылки: последний пользователь, которому она уже ушла
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('UPDATE reminders SET progress_user_id = ? WHERE id = ?', (progress_user_id, reminder_id))
+        conn.commit()
+        conn.close()
+        logger.info(f"Saved progress of reminder {reminder_id} at user {progress_user_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Error saving progress of reminder {reminder_id}: {e}")
+        return False
+
+def get_user_reminders(bot_id: int, user_id: int):
     try:
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
         c.execute('''
-            SELECT id, text, reminder_time, is_sent 
+            SELECT id, text, reminder_time, is_sent, media_type
             FROM reminders 
-            WHERE user_id = ? 
+            WHERE bot_id = ? AND user_id = ? 
             ORDER BY reminder_time ASC, is_sent ASC
-        ''', (user_id,))
+        ''', (bot_id, user_id))
         reminders = c.fetchall()
         conn.close()
         return reminders
@@ -136,36 +355,271 @@ def get_user_reminders(user_id: int):
         logger.error(f"Error getting reminders for user {user_id}: {e}")
         return []
 
-def update_reminder(reminder_id: int, text: str = None, reminder_time: datetime = None):
+def update_reminder(reminder_id: int, text: str = None, reminder_time: datetime = None, bot_id: int = None):
     try:
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
         
+        # bot_id ограничивает изменение напоминаниями одного бота (для админов)
+        where = 'id = ?' if bot_id is None else 'id = ? AND bot_id = ?'
+        key = (reminder_id,) if bot_id is None else (reminder_id, bot_id)
         if text is not None and reminder_time is not None:
-            c.execute('''
+            c.execute(f'''
                 UPDATE reminders 
                 SET text = ?, reminder_time = ? 
-                WHERE id = ?
-            ''', (text, reminder_time.isoformat(), reminder_id))
+                WHERE {where}
+            ''', (text, reminder_time.isoformat()) + key)
         elif text is not None:
-            c.execute('UPDATE reminders SET text = ? WHERE id = ?', (text, reminder_id))
+            c.execute(f'UPDATE reminders SET text = ? WHERE {where}', (text,) + key)
         elif reminder_time is not None:
-            c.execute('UPDATE reminders SET reminder_time = ? WHERE id = ?', (reminder_time.isoformat(), reminder_id))
+            c.execute(f'UPDATE reminders SET reminder_time = ? WHERE {where}', (reminder_time.isoformat(),) + key)
+        updated = c.rowcount
             
         conn.commit()
         conn.close()
-        return True
+        return updated > 0
     except Exception as e:
         logger.error(f"Error updating reminder {reminder_id}: {e}")
         return False
 
+def add_retries(retries) -> bool:
+    # retries: список (reminder_id, user_id, bot_id, text, media_type, media_file_id,
+    # attempts, next_attempt_at, last_error), записывается одной транзакцией
+    if not retries:
+        return True
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.executemany('''
+            INSERT OR REPLACE INTO retry_queue
+                (reminder_id, user_id, bot_id, text, media_type, media_file_id, attempts, next_attempt_at, last_error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [retry[:7] + (retry[7].isoformat(),) + retry[8:] for retry in retries])
+        conn.commit()
+        conn.close()
+        logger.info(f"Queued {len(retries)} deliveries for retry")
+        return True
+    except Exception as e:
+        logger.error(f"Error queueing {len(retries)} retries: {e}")
+        return False
+
+def get_due_retries(bot_ids, limit: int):
+    try:
+        bot_ids = list(bot_ids)
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT reminder_id, user_id, bot_id, text, media_type, media_file_id, attempts
+            FROM retry_queue
+            WHERE next_attempt_at <= ? AND bot_id IN ({', '.join('?' * len(bot_ids))})
+            ORDER BY next_attempt_at ASC
+            LIMIT ?
+        ''', (get_moscow_time().isoformat(), *bot_ids, limit))
+        retries = c.fetchall()
+        conn.close()
+        return retries
+    except Exception as e:
+        logger.error(f"Error getting due retries: {e}")
+        return []
+
+def delete_retries(keys) -> bool:
+    # keys: список (reminder_id, user_id)
+    if not keys:
+        return True
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.executemany('DELETE FROM retry_queue WHERE reminder_id = ? AND user_id = ?', keys)
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting {len(keys)} retries: {e}")
+        return False
+
+def add_deferred(deliveries) -> bool:
+    # deliveries: список (reminder_id, user_id, bot_id, text, media_type, media_file_id, release_at)
+    if not deliveries:
+        return True
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.executemany('''
+            INSERT OR REPLACE INTO deferred_queue
+                (reminder_id, user_id, bot_id, text, media_type, media_file_id, release_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [delivery[:6] + (delivery[6].isoformat(),) for delivery in deliveries])
+        conn.commit()
+        conn.close()
+        logger.info(f"Deferred {len(deliveries)} deliveries until the end of quiet hours")
+        return True
+    except Exception as e:
+        logger.error(f"Error deferring {len(deliveries)} deliveries: {e}")
+        return False
+
+def get_due_deferred(bot_id: int, limit: int):
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT reminder_id, user_id, bot_id, text, media_type, media_file_id
+            FROM deferred_queue
+            WHERE bot_id = ? AND release_at <= ?
+            ORDER BY release_at ASC
+            LIMIT ?
+        ''', (bot_id, get_moscow_time().isoformat(), limit))
+        deliveries = c.fetchall()
+        conn.close()
+        return deliveries
+    except Exception as e:
+        logger.error(f"Error getting deferred deliveries of bot {bot_id}: {e}")
+        return []
+
+def count_deferred(bot_id: int) -> int:
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM deferred_queue WHERE bot_id = ?', (bot_id,))
+        count = c.fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        logger.error(f"Error counting deferred deliveries of bot {bot_id}: {e}")
+        return 0
+
+def get_next_deferred_release(bot_id: int):
+    # Ближайшее время выпуска отложенной доставки бота или None
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT MIN(release_at) FROM deferred_queue WHERE bot_id = ?', (bot_id,))
+        release_at = c.fetchone()[0]
+        conn.close()
+        return datetime.fromisoformat(release_at) if release_at else None
+    except Exception as e:
+        logger.error(f"Error getting next deferred release of bot {bot_id}: {e}")
+        return None
+
+def delete_deferred(keys) -> bool:
+    # keys: список (reminder_id, user_id)
+    if not keys:
+        return True
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.executemany('DELETE FROM deferred_queue WHERE reminder_id = ? AND user_id = ?', keys)
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting {len(keys)} deferred deliveries: {e}")
+        return False
+
+def init_reminder_stats(reminder_id: int, bot_id: int, user_id: int, text: str, reminder_time: str,
+                        targeted: int) -> bool:
+    # Число получателей записывается один раз, при первом запуске рассылки.
+    # После возобновления строка уже есть и не меняется
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('''
+            INSERT OR IGNORE INTO reminder_stats (reminder_id, bot_id, user_id, text, reminder_time, targeted)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (reminder_id, bot_id, user_id, text, reminder_time, targeted))
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error creating stats for reminder {reminder_id}: {e}")
+        return False
+
+def update_reminder_stats(increments, failures) -> bool:
+    # increments: список (sent, deferred, retrying, failed,
+    # first_sent_at, last_sent_at, reminder_id); failures: список (reminder_id, reason, count).
+    # Все приращения пачки записываются одной транзакцией
+    if not increments and not failures:
+        return True
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.executemany('''
+            UPDATE reminder_stats SET
+                sent = sent + ?1,
+                deferred = deferred + ?2,
+                retrying = retrying + ?3,
+                failed = failed + ?4,
+                first_sent_at = COALESCE(MIN(first_sent_at, ?5), first_sent_at, ?5),
+                last_sent_at = COALESCE(MAX(last_sent_at, ?6), last_sent_at, ?6)
+            WHERE reminder_id = ?7
+        ''', increments)
+        c.executemany('''
+            INSERT INTO reminder_failures (reminder_id, reason, count) VALUES (?, ?, ?)
+            ON CONFLICT (reminder_id, reason) DO UPDATE SET count = count + excluded.count
+        ''', failures)
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error updating reminder stats: {e}")
+        return False
+
+def get_reminder_stats(reminder_ids):
+    # Статистика и причины ошибок для списка напоминаний двумя запросами по ключу
+    try:
+        reminder_ids = list(reminder_ids)
+        if not reminder_ids:
+            return {}, {}
+        placeholders = ', '.join('?' * len(reminder_ids))
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT reminder_id, targeted, sent, deferred, retrying, failed, first_sent_at, last_sent_at
+            FROM reminder_stats
+            WHERE reminder_id IN ({placeholders})
+        ''', reminder_ids)
+        stats = {row[0]: row[1:] for row in c.fetchall()}
+        c.execute(f'''
+            SELECT reminder_id, reason, count
+            FROM reminder_failures
+            WHERE reminder_id IN ({placeholders})
+            ORDER BY count DESC
+        ''', reminder_ids)
+        failures = {}
+        for reminder_id, reason, count in c.fetchall():
+            failures.setdefault(reminder_id, []).append((reason, count))
+        conn.close()
+        return stats, failures
+    except Exception as e:
+        logger.error(f"Error getting reminder stats: {e}")
+        return {}, {}
+
+def get_recent_broadcasts(bot_id: int, user_id: int, limit: int):
+    # Последние рассылки, напоминания которых уже удалены после отправки
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT reminder_id, text, reminder_time
+            FROM reminder_stats
+            WHERE bot_id = ? AND user_id = ?
+                AND reminder_id NOT IN (SELECT id FROM reminders)
+            ORDER BY reminder_id DESC
+            LIMIT ?
+        ''', (bot_id, user_id, limit))
+        broadcasts = c.fetchall()
+        conn.close()
+        return broadcasts
+    except Exception as e:
+        logger.error(f"Error getting recent broadcasts of user {user_id}: {e}")
+        return []
+
 def get_moscow_time():
     moscow_tz = pytz.timezone('Europe/Moscow')
     return datetime.now(moscow_tz)
 
 def debug_print_reminders():
     try:
-        conn = sqlite3.connect('reminders.db')
+        conn = get_connection()
         c = conn.cursor()
         c.execute('SELECT * FROM reminders')
         reminders = c.fetchall()
@@ -1,11 +1,9 @@
 import logging
-import os
 from datetime import datetime
 import pytz
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from dotenv import load_dotenv
 
 from database import (
     add_or_update_user,
@@ -13,28 +11,69 @@ from database import (
     get_user_reminders,
     update_reminder,
     delete_reminder,
+    set_user_quiet_hours,
+    get_user_quiet_hours,
+    get_reminder_stats,
+    get_recent_broadcasts,
     get_moscow_time
 )
 from keyboards import admin_kb, cancel_kb, edit_kb, main_menu_kb
+from middlewares import handler_latency
+from profiling import (
+    capture_cpu_profile,
+    capture_memory_profile,
+    is_profiling,
+    MAX_PROFILE_SECONDS
+)
+from quiet_hours import parse_quiet_hours, quiet_hours_for, format_quiet_hours
 from states import ReminderStates
-
-# Загрузка переменных окружения
-load_dotenv()
+from tenants import is_admin
 
 logger = logging.getLogger(__name__)
 
-ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
+MEDIA_LABELS = {
+    'photo': "🖼 фото",
+    'document': "📎 документ"
+}
+
+# Сколько последних завершенных рассылок показывать в списке напоминаний
+RECENT_BROADCASTS_LIMIT = 5
+
+def format_delivery_stats(stats, failures) -> str:
+    targeted, sent, deferred, retrying, failed, first_sent_at, last_sent_at = stats
+    response = "\n📊 Доставка\n"
+    # Каждый обработанный получатель учтен ровно в одном из счетчиков
+    processed = sent + deferred + retrying + failed
+    response += f"Получателей: {targeted}\n"
+    if processed < targeted:
+        response += f"Обработано: {processed} из {targeted}\n"
+    response += f"Отправлено: {sent}\n"
+    if deferred:
+        response += f"Отложено (тихие часы): {deferred}\n"
+    if retrying:
+        response += f"Ожидают повтора: {retrying}\n"
+    if failed:
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in failures or [])
+        response += f"Ошибок: {failed} ({reasons})\n"
+    if first_sent_at:
+        first_sent_at = datetime.fromisoformat(first_sent_at)
+        last_sent_at = datetime.fromisoformat(last_sent_at)
+        response += f"Первая отправка: {first_sent_at.strftime('%d.%m.%Y %H:%M:%S')}\n"
+        response += f"Последняя отправка: {last_sent_at.strftime('%d.%m.%Y %H:%M:%S')}\n"
+        response += f"Длительность: {(last_sent_at - first_sent_at).total_seconds():.0f} с\n"
+    return response
 
 async def send_welcome(message: types.Message):
     # Добавляем всех пользователей, включая админа, в базу данных
     add_or_update_user(
+        message.bot.id,
         message.from_user.id,
         message.from_user.username,
         message.from_user.first_name,
         message.from_user.last_name
     )
     
-    if message.from_user.id == ADMIN_ID:
+    if is_admin(message.bot.id, message.from_user.id):
         await message.answer("Привет, админ!", reply_markup=admin_kb)
     else:
         await message.answer(
@@ -43,11 +82,11 @@ async def send_welcome(message: types.Message):
         )
 
 async def create_reminder(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
     await message.answer(
-        "Введите текст напоминания:",
+        "Введите текст напоминания или отправьте фото/документ с подписью:",
         reply_markup=cancel_kb
     )
     await state.set_state(ReminderStates.waiting_for_text)
@@ -58,7 +97,29 @@ async def process_reminder_text(message: types.Message, state: FSMContext):
         await message.answer("Создание напоминания отменено", reply_markup=admin_kb)
         return
 
-    await state.update_data(reminder_text=message.text)
+    # Для фото и документов запоминаем file_id, который Telegram уже выдал
+    # при получении сообщения: при рассылке файл повторно не загружается
+    if message.photo:
+        media_type, media_file_id = 'photo', message.photo[-1].file_id
+        reminder_text = message.caption or ''
+    elif message.document:
+        media_type, media_file_id = 'document', message.document.file_id
+        reminder_text = message.caption or ''
+    elif message.text:
+        media_type, media_file_id = None, None
+        reminder_text = message.text
+    else:
+        await message.answer(
+            "Поддерживаются только текст, фото и документы. Попробуйте еще раз:",
+            reply_markup=cancel_kb
+        )
+        return
+
+    await state.update_data(
+        reminder_text=reminder_text,
+        media_type=media_type,
+        media_file_id=media_file_id
+    )
     current_time = get_moscow_time()
     await message.answer(
         f"Введите дату и время напоминания в формате ДД.ММ.ГГГГ ЧЧ:ММ (например, {current_time.strftime('%d.%m.%Y %H:%M')}):",
@@ -86,14 +147,23 @@ async def process_reminder_time(message: types.Message, state: FSMContext):
 
         data = await state.get_data()
         reminder_text = data['reminder_text']
+        media_type = data.get('media_type')
         
         try:
-            reminder_id = add_reminder(message.from_user.id, reminder_text, reminder_time)
-            
-            await message.answer(
-                f"Напоминание создано!\nID: {reminder_id}\nТекст: {reminder_text}\nВремя: {reminder_time.strftime('%d.%m.%Y %H:%M')} (МСК)",
-                reply_markup=admin_kb
+            reminder_id = add_reminder(
+                message.bot.id,
+                message.from_user.id,
+                reminder_text,
+                reminder_time,
+                media_type,
+                data.get('media_file_id')
             )
+            
+            response = f"Напоминание создано!\nID: {reminder_id}\nТекст: {reminder_text}\n"
+            if media_type:
+                response += f"Вложение: {MEDIA_LABELS[media_type]}\n"
+            response += f"Время: {reminder_time.strftime('%d.%m.%Y %H:%M')} (МСК)"
+            await message.answer(response, reply_markup=admin_kb)
         except Exception as e:
             logger.error(f"Error saving reminder: {e}")
             await message.answer(
@@ -111,22 +181,37 @@ async def process_reminder_time(message: types.Message, state: FSMContext):
         )
 
 async def list_reminders(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
-    reminders = get_user_reminders(message.from_user.id)
-    if not reminders:
+    reminders = get_user_reminders(message.bot.id, message.from_user.id)
+    broadcasts = get_recent_broadcasts(message.bot.id, message.from_user.id, RECENT_BROADCASTS_LIMIT)
+    if not reminders and not broadcasts:
         await message.answer("У вас пока нет напоминаний.", reply_markup=admin_kb)
         return
     
-    for reminder_id, text, reminder_time, is_sent in reminders:
-        status = "✅ Отправлено" if is_sent else "⏳ Ожидает"
+    # Статистика берется из сводной таблицы одним запросом на весь список
+    stats, failures = get_reminder_stats(
+        [reminder[0] for reminder in reminders] + [broadcast[0] for broadcast in broadcasts]
+    )
+    
+    for reminder_id, text, reminder_time, is_sent, media_type in reminders:
+        if is_sent:
+            status = "✅ Отправлено"
+        elif reminder_id in stats:
+            status = "📤 Рассылается"
+        else:
+            status = "⏳ Ожидает"
         reminder_time = datetime.fromisoformat(reminder_time)
         
         response = f"📋 Напоминание #{reminder_id}\n\n"
         response += f"Текст: {text}\n"
+        if media_type:
+            response += f"Вложение: {MEDIA_LABELS[media_type]}\n"
         response += f"Время: {reminder_time.strftime('%d.%m.%Y %H:%M')} (МСК)\n"
         response += f"Статус: {status}\n"
+        if reminder_id in stats:
+            response += format_delivery_stats(stats[reminder_id], failures.get(reminder_id))
         
         keyboard = []
         if not is_sent:  # Показываем кнопки редактирования только для неотправленных напоминаний
@@ -142,10 +227,21 @@ async def list_reminders(message: types.Message):
             await message.answer(response, reply_markup=reply_markup)
         else:
             await message.answer(response)
+    
+    for reminder_id, text, reminder_time in broadcasts:
+        reminder_time = datetime.fromisoformat(reminder_time)
+        
+        response = f"📋 Напоминание #{reminder_id}\n\n"
+        response += f"Текст: {text}\n"
+        response += f"Время: {reminder_time.strftime('%d.%m.%Y %H:%M')} (МСК)\n"
+        response += "Статус: ✅ Отправлено\n"
+        if reminder_id in stats:
+            response += format_delivery_stats(stats[reminder_id], failures.get(reminder_id))
+        await message.answer(response)
 
 async def process_edit_callback(callback_query: types.CallbackQuery, state: FSMContext):
     logger.info(f"Received edit callback with data: {callback_query.data}")
-    if callback_query.from_user.id != ADMIN_ID:
+    if not is_admin(callback_query.bot.id, callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для редактирования напоминаний")
         return
     
@@ -164,7 +260,7 @@ async def process_edit_callback(callback_query: types.CallbackQuery, state: FSMC
         await callback_query.answer("Произошла ошибка при обработке запроса")
 
 async def process_edit_text_choice(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
     data = await state.get_data()
@@ -179,7 +275,7 @@ async def process_edit_text_choice(message: types.Message, state: FSMContext):
     await state.set_state(ReminderStates.editing_reminder_text)
 
 async def process_edit_time_choice(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
     data = await state.get_data()
@@ -195,7 +291,7 @@ async def process_edit_time_choice(message: types.Message, state: FSMContext):
     await state.set_state(ReminderStates.editing_reminder_time)
 
 async def process_delete_reminder(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
     data = await state.get_data()
@@ -204,7 +300,7 @@ async def process_delete_reminder(message: types.Message, state: FSMContext):
         return
     
     reminder_id = data['editing_reminder_id']
-    if delete_reminder(reminder_id):
+    if delete_reminder(reminder_id, bot_id=message.bot.id):
         await message.answer("Напоминание успешно удалено!", reply_markup=admin_kb)
     else:
         await message.answer("Произошла ошибка при удалении напоминания", reply_markup=admin_kb)
@@ -217,13 +313,13 @@ async def process_edit_text(message: types.Message, state: FSMContext):
         await message.answer("Возврат на главную", reply_markup=admin_kb)
         return
         
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
     data = await state.get_data()
     reminder_id = data['editing_reminder_id']
     
-    if update_reminder(reminder_id, text=message.text):
+    if update_reminder(reminder_id, text=message.text, bot_id=message.bot.id):
         await message.answer("Текст напоминания успешно обновлен!", reply_markup=admin_kb)
     else:
         await message.answer("Произошла ошибка при обновлении текста напоминания", reply_markup=admin_kb)
@@ -236,7 +332,7 @@ async def process_edit_time(message: types.Message, state: FSMContext):
         await message.answer("Возврат на главную", reply_markup=admin_kb)
         return
         
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.bot.id, message.from_user.id):
         return
     
     try:
@@ -254,7 +350,7 @@ async def process_edit_time(message: types.Message, state: FSMContext):
         data = await state.get_data()
         reminder_id = data['editing_reminder_id']
         
-        if update_reminder(reminder_id, reminder_time=new_time):
+        if update_reminder(reminder_id, reminder_time=new_time, bot_id=message.bot.id):
             await message.answer("Время напоминания успешно обновлено!", reply_markup=admin_kb)
         else:
             await message.answer("Произошла ошибка при обновлении времени напоминания", reply_markup=admin_kb)
@@ -276,6 +372,7 @@ async def track_user(message: types.Message):
     try:
         logger.info(f"Tracking user: {message.from_user.id}")
         add_or_update_user(
+            message.bot.id,
             message.from_user.id,
             message.from_user.username,
             message.from_user.first_name,
@@ -283,4 +380,88 @@ async def track_user(message: types.Message):
         )
         logger.info(f"Successfully tracked user: {message.from_user.id}")
     except Exception as e:
-        logger.error(f"Error tracking user {message.from_user.id}: {e}") 
\ No newline at end of file
+        logger.error(f"Error tracking user {message.from_user.id}: {e}") 
+
+async def latency_stats(message: types.Message):
+    if not is_admin(message.bot.id, message.from_user.id):
+        return
+
+    await message.answer(handler_latency.summary())
+
+async def profile_command(message: types.Message, command: CommandObject):
+    if not is_admin(message.bot.id, message.from_user.id):
+        return
+
+    # Формат: /profile [cpu|mem] [секунды]
+    args = (command.args or "").split()
+    mode = args[0] if args else "cpu"
+    try:
+        seconds = int(args[1]) if len(args) > 1 else 30
+    except ValueError:
+        seconds = 0
+
+    if mode not in ("cpu", "mem") or not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        await message.answer(
+            f"Использование: /profile [cpu|mem] [секунды от 1 до {MAX_PROFILE_SECONDS}]"
+        )
+        return
+
+    if is_profiling():
+        await message.answer("Профилирование уже выполняется, дождитесь результата")
+        return
+
+    await message.answer(f"Снимаю профиль ({mode}) в течение {seconds} с...")
+    try:
+        if mode == "cpu":
+            report = await capture_cpu_profile(seconds)
+        else:
+            report = await capture_memory_profile(seconds)
+    except Exception as e:
+        logger.error(f"Error capturing {mode} profile: {e}")
+        await message.answer("Произошла ошибка при профилировании")
+        return
+
+    filename = f"profile_{mode}_{get_moscow_time().strftime('%Y%m%d_%H%M%S')}.txt"
+    await message.answer_document(
+        types.BufferedInputFile(report.encode('utf-8'), filename=filename),
+        caption=f"Профиль {mode} за {seconds} с"
+    )
+
+async def quiet_hours_command(message: types.Message, command: CommandObject):
+    # Формат: /quiet ЧЧ:ММ-ЧЧ:ММ | /quiet off | /quiet default | /quiet
+    add_or_update_user(
+        message.bot.id,
+        message.from_user.id,
+        message.from_user.username,
+        message.from_user.first_name,
+        message.from_user.last_name
+    )
+    value = (command.args or "").strip()
+
+    if not value:
+        quiet_hours = quiet_hours_for(get_user_quiet_hours(message.bot.id, message.from_user.id))
+        await message.answer(
+            f"Тихие часы: {format_quiet_hours(quiet_hours)} (МСК)\n\n"
+            "В это время напоминания не приходят и доставляются после окончания тихих часов.\n"
+            "/quiet 23:00-08:00 - задать свои тихие часы\n"
+            "/quiet off - отключить\n"
+            "/quiet default - вернуть общие настройки"
+        )
+        return
+
+    if value == "off":
+        quiet_hours = ""
+    elif value == "default":
+        quiet_hours = None
+    else:
+        try:
+            start, end = parse_quiet_hours(value)
+        except ValueError:
+            await message.answer("Неверный формат. Пример: /quiet 23:00-08:00")
+            return
+        quiet_hours = format_quiet_hours((start, end))
+
+    if set_user_quiet_hours(message.bot.id, message.from_user.id, quiet_hours):
+        await message.answer(f"Тихие часы: {format_quiet_hours(quiet_hours_for(quiet_hours))} (МСК)")
+    else:
+        await message.answer("Произошла ошибка при сохранении тихих часов")
\ No newline at end of file
@@ -0,0 +1,258 @@
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+from dotenv import load_dotenv
+
+from middlewares import handler_latency, percentile
+
+# Нагрузочный тест входящих апдейтов: синтетические Update прогоняются через
+# dp.feed_update из main.py с фейковой сессией бота, поэтому запросы к Telegram
+# не уходят, а база и лог создаются во временной директории.
+
+FAKE_TOKEN = '123456789:LOADTEST'
+ADMIN_ID = 1000
+
+
+class FakeSession(BaseSession):
+    # Сессия, которая отвечает на любой метод Bot API без обращения к сети.
+    # api_latency имитирует время ответа Telegram.
+
+    def __init__(self, api_latency: float = 0.0):
+        super().__init__()
+        self.api_latency = api_latency
+        self.requests = 0
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        returning = getattr(method, '__returning__', None)
+        if returning is bool:
+            return True
+        if getattr(returning, '__name__', None) == 'Message':
+            self._message_id += 1
+            chat_id = getattr(method, 'chat_id', ADMIN_ID)
+            return returning.model_validate(
+                {
+                    'message_id': self._message_id,
+                    'date': datetime.now(),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'text': getattr(method, 'text', None),
+                },
+                context={'bot': bot}
+            )
+        if getattr(returning, '__name__', None) == 'User':
+            return returning(id=bot.id, is_bot=True, first_name='LoadTest', username='loadtest_bot')
+        return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def message(self, user_id: int, text: str, chat_id: int = None) -> Update:
+        update_id, message_id = self._next_ids()
+        return Update.model_validate(
+            {
+                'update_id': update_id,
+                'message': {
+                    'message_id': message_id,
+                    'date': datetime.now(),
+                    'chat': {'id': chat_id or user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+                    'text': text,
+                },
+            },
+            context={'bot': self.bot}
+        )
+
+    def callback(self, user_id: int, data: str, chat_id: int = None) -> Update:
+        update_id, message_id = self._next_ids()
+        chat_id = chat_id or user_id
+        return Update.model_validate(
+            {
+                'update_id': update_id,
+                'callback_query': {
+                    'id': str(update_id),
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'Admin'},
+                    'chat_instance': str(chat_id),
+                    'data': data,
+                    'message': {
+                        'message_id': message_id,
+                        'date': datetime.now(),
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'text': 'reminder',
+                    },
+                },
+            },
+            context={'bot': self.bot}
+        )
+
+
+class LoadTest:
+    def __init__(self, dp, bot, reminder_id: int):
+        self.dp = dp
+        self.bot = bot
+        self.reminder_id = reminder_id
+        self.factory = UpdateFactory(bot)
+        self.update_latency = []
+        self.errors = 0
+        self._admin_chats = iter(range(10 ** 9, 2 * 10 ** 9))
+
+        # Время хендлеров пишет LatencyMiddleware из main.py (то же, что
+        # показывает /latency). Окно снимаем, чтобы отчет охватывал весь прогон
+        handler_latency.samples.clear()
+        handler_latency.counts.clear()
+        handler_latency.window = None
+
+    async def feed(self, update: Update):
+        start = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors += 1
+            logging.getLogger(__name__).error(f"Error handling update {update.update_id}: {e}")
+        self.update_latency.append(time.perf_counter() - start)
+
+    # Сценарии: каждый возвращает последовательность апдейтов одного чата
+
+    def scenario_start(self):
+        yield self.factory.message(random.randint(1, 10 ** 6), '/start')
+
+    def scenario_message(self):
+        yield self.factory.message(random.randint(1, 10 ** 6), 'Привет')
+
+    def scenario_admin(self):
+        # Отдельный чат на каждый диалог, чтобы состояния FSM не пересекались
+        chat_id = next(self._admin_chats)
+        reminder_time = datetime.now() + timedelta(days=1)
+        yield self.factory.message(ADMIN_ID, 'Создать напоминание', chat_id)
+        yield self.factory.message(ADMIN_ID, 'Нагрузочный тест', chat_id)
+        yield self.factory.message(ADMIN_ID, reminder_time.strftime('%d.%m.%Y %H:%M'), chat_id)
+
+    def scenario_edit(self):
+        chat_id = next(self._admin_chats)
+        yield self.factory.callback(ADMIN_ID, f'edit_{self.reminder_id}', chat_id)
+        yield self.factory.message(ADMIN_ID, '📝 Изменить текст', chat_id)
+        yield self.factory.message(ADMIN_ID, 'Нагрузочный тест (изменено)', chat_id)
+
+    async def run(self, scenarios: int, concurrency: int, mix: dict):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        queue = asyncio.Queue()
+        for name in random.choices(names, weights, k=scenarios):
+            queue.put_nowait(getattr(self, f'scenario_{name}'))
+
+        async def worker():
+            while not queue.empty():
+                scenario = queue.get_nowait()
+                for update in scenario():
+                    await self.feed(update)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition(':')
+        if name not in ('start', 'message', 'admin', 'edit'):
+            raise argparse.ArgumentTypeError(f"unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def print_report(test: LoadTest, elapsed: float, session: FakeSession):
+    total = len(test.update_latency)
+    print(f"Updates: {total}, errors: {test.errors}, API calls: {session.requests}")
+    print(f"Elapsed: {elapsed:.2f}s, throughput: {total / elapsed:.1f} updates/sec")
+    print()
+    print(f"{'handler':<28}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = sorted((name, list(values)) for name, values in handler_latency.samples.items())
+    rows.append(('<feed_update>', test.update_latency))
+    for name, values in rows:
+        print(
+            f"{name:<28}{len(values):>8}"
+            f"{sum(values) / len(values) * 1000:>10.2f}"
+            f"{percentile(values, 50) * 1000:>10.2f}"
+            f"{percentile(values, 95) * 1000:>10.2f}"
+            f"{percentile(values, 99) * 1000:>10.2f}"
+            f"{max(values) * 1000:>10.2f}"
+        )
+
+
+async def run_loadtest(args):
+    # main.py при импорте создает бота и настраивает логирование в bot.log,
+    # поэтому переменные окружения и рабочая директория задаются заранее
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix='loadtest_'))
+    # .env загружаем сами, чтобы следующие load_dotenv() не вернули настройки
+    # рабочего бота: база - только в рабочей директории теста, дополнительные
+    # боты отключаются пустым токеном
+    load_dotenv(os.path.join(sys.path[0], '.env'))
+    for key in list(os.environ):
+        if re.fullmatch(r'(BOT_TOKEN|ADMIN_ID)_\d+', key):
+            os.environ[key] = ''
+    os.environ['BOT_TOKEN'] = FAKE_TOKEN
+    os.environ['ADMIN_ID'] = str(ADMIN_ID)
+    os.environ['DB_PATH'] = os.path.abspath('reminders.db')
+
+    import main as bot_main
+    from database import init_db, add_reminder, get_moscow_time
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    init_db()
+    session = FakeSession(api_latency=args.api_latency)
+    bot = bot_main.Bot(token=FAKE_TOKEN, session=session)
+    reminder_id = add_reminder(bot.id, ADMIN_ID, 'Нагрузочный тест', get_moscow_time() + timedelta(days=1))
+    test = LoadTest(bot_main.dp, bot, reminder_id)
+    elapsed = await test.run(args.scenarios, args.concurrency, args.mix)
+    print(f"Working directory: {os.getcwd()}")
+    print_report(test, elapsed, session)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic update load test for the bot handlers")
+    parser.add_argument('--scenarios', type=int, default=1000, help="number of scenarios to run")
+    parser.add_argument('--concurrency', type=int, default=50, help="number of concurrent workers")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('start:2,message:6,admin:1,edit:1'),
+                        help="scenario weights, e.g. start:2,message:6,admin:1,edit:1")
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help="simulated Bot API response time in seconds")
+    parser.add_argument('--workdir', help="directory for reminders.db and bot.log (default: temporary)")
+    parser.add_argument('--verbose', action='store_true', help="keep INFO logging from handlers")
+    asyncio.run(run_loadtest(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
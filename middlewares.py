@@ -0,0 +1,74 @@
+import time
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних замеров хранить на каждый хендлер
+LATENCY_WINDOW = 1000
+# Хендлеры медленнее этого порога логируются как предупреждение
+SLOW_HANDLER_SECONDS = 1.0
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+class HandlerLatency:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float):
+        if name not in self.samples:
+            self.samples[name] = deque(maxlen=self.window)
+            self.counts[name] = 0
+        self.samples[name].append(seconds)
+        self.counts[name] += 1
+
+    def summary(self) -> str:
+        if not self.samples:
+            return "Нет данных о времени работы хендлеров"
+
+        lines = [f"Время хендлеров, мс (последние {self.window} вызовов)", ""]
+        for name in sorted(self.samples):
+            values = list(self.samples[name])
+            lines.append(
+                f"{name}: n={self.counts[name]} "
+                f"p50={percentile(values, 50) * 1000:.1f} "
+                f"p95={percentile(values, 95) * 1000:.1f} "
+                f"p99={percentile(values, 99) * 1000:.1f} "
+                f"max={max(values) * 1000:.1f}"
+            )
+        return "\n".join(lines)
+
+handler_latency = HandlerLatency()
+
+class LatencyMiddleware(BaseMiddleware):
+    # Регистрируется как внутренний middleware: только на этом уровне в data
+    # уже есть выбранный хендлер, и время пишется по имени его функции
+    def __init__(self, latency: HandlerLatency = handler_latency):
+        self.latency = latency
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data['handler'].callback.__name__
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.latency.record(name, elapsed)
+            if elapsed > SLOW_HANDLER_SECONDS:
+                logger.warning(f"Slow handler {name}: {elapsed:.2f}s")
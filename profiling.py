@@ -0,0 +1,64 @@
+import io
+import cProfile
+import pstats
+import asyncio
+import logging
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILE_SECONDS = 300
+TOP_ENTRIES = 50
+
+# cProfile и tracemalloc глобальны для процесса, поэтому одновременно
+# допускается только один снимок
+_profile_lock = asyncio.Lock()
+
+def is_profiling() -> bool:
+    return _profile_lock.locked()
+
+async def capture_cpu_profile(seconds: int) -> str:
+    # Профилировщик включается в потоке event loop, поэтому в отчет попадают
+    # все хендлеры и рассылки, выполненные за время снимка
+    async with _profile_lock:
+        logger.info(f"Starting CPU profile for {seconds}s")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_ENTRIES)
+        output.write("\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_ENTRIES)
+        logger.info("CPU profile finished")
+        return output.getvalue()
+
+async def capture_memory_profile(seconds: int) -> str:
+    async with _profile_lock:
+        logger.info(f"Starting memory profile for {seconds}s")
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+        lines = [
+            f"Traced memory: current={current / 1024:.1f} KiB, peak={peak / 1024:.1f} KiB",
+            "",
+            f"Top {TOP_ENTRIES} allocation changes over {seconds}s:",
+        ]
+        lines.extend(str(stat) for stat in after.compare_to(before, 'lineno')[:TOP_ENTRIES])
+        lines.extend(["", f"Top {TOP_ENTRIES} allocations at the end of the snapshot:"])
+        lines.extend(str(stat) for stat in after.statistics('lineno')[:TOP_ENTRIES])
+        logger.info("Memory profile finished")
+        return "\n".join(lines)
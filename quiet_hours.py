@@ -0,0 +1,155 @@
+import os
+import re
+import random
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+from typing import Optional, Tuple
+
+import pytz
+from dotenv import load_dotenv
+
+from database import (
+    add_retries,
+    get_due_deferred,
+    get_next_deferred_release,
+    delete_deferred,
+    get_moscow_time
+)
+from retries import retry_entry, RETRY_MAX_ATTEMPTS
+from sender import sender, is_transient_error, RateLimiter
+from stats import StatsBatch, failure_reason
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Окно, растянутое на сколько секунд после конца тихих часов, в которое
+# выпускаются отложенные доставки, чтобы не создавать пик в одну минуту.
+# Для большой очереди окно растягивается до времени ее выпуска
+QUIET_RELEASE_SPREAD = float(os.getenv('QUIET_RELEASE_SPREAD', '900'))
+# Скорость выпуска отложенных доставок на бота, сообщений в секунду.
+# Меньше BOT_RATE_LIMIT, чтобы оставить запас для обычных рассылок
+DEFERRED_RATE_LIMIT = float(os.getenv('DEFERRED_RATE_LIMIT', '20'))
+DEFERRED_POLL_INTERVAL = 30
+# Минимальная пауза цикла выпуска, чтобы ошибка чтения очереди не давала
+# цикла без ожидания
+DEFERRED_MIN_WAIT = 1
+DEFERRED_BATCH_SIZE = 100
+
+QUIET_HOURS_PATTERN = re.compile(r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})')
+
+def parse_quiet_hours(value: str) -> Tuple[time, time]:
+    # 'ЧЧ:ММ-ЧЧ:ММ' по московскому времени, окно может переходить через полночь
+    match = QUIET_HOURS_PATTERN.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f"Invalid quiet hours: {value}")
+    start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+    start = time(start_hour, start_minute)
+    end = time(end_hour, end_minute)
+    if start == end:
+        raise ValueError(f"Quiet hours must not be empty: {value}")
+    return start, end
+
+# Общие тихие часы для всех пользователей, например QUIET_HOURS=23:00-08:00
+GLOBAL_QUIET_HOURS = parse_quiet_hours(os.getenv('QUIET_HOURS')) if os.getenv('QUIET_HOURS') else None
+
+def quiet_hours_for(user_quiet_hours: Optional[str]) -> Optional[Tuple[time, time]]:
+    # NULL - общие тихие часы, '' - пользователь их отключил
+    if user_quiet_hours is None:
+        return GLOBAL_QUIET_HOURS
+    if not user_quiet_hours:
+        return None
+    try:
+        return parse_quiet_hours(user_quiet_hours)
+    except ValueError:
+        return GLOBAL_QUIET_HOURS
+
+def quiet_hours_end(quiet_hours: Optional[Tuple[time, time]], now: datetime) -> Optional[datetime]:
+    # Время окончания тихих часов, если now попадает в них, иначе None
+    if quiet_hours is None:
+        return None
+    start, end = quiet_hours
+    current = now.time()
+    end_date = now.date()
+    if start < end:
+        if not start <= current < end:
+            return None
+    else:
+        if end <= current < start:
+            return None
+        if current >= start:
+            end_date += timedelta(days=1)
+    return pytz.timezone('Europe/Moscow').localize(datetime.combine(end_date, end))
+
+def release_time(quiet_end: datetime, backlog: int = 0) -> datetime:
+    # Случайный сдвиг сглаживает выпуск очереди. Окно не короче времени, за
+    # которое backlog доставок выпускается со скоростью DEFERRED_RATE_LIMIT,
+    # иначе доставки становятся готовыми быстрее, чем их можно отправить
+    spread = max(QUIET_RELEASE_SPREAD, backlog / DEFERRED_RATE_LIMIT)
+    return quiet_end + timedelta(seconds=random.uniform(0, spread))
+
+def format_quiet_hours(quiet_hours: Optional[Tuple[time, time]]) -> str:
+    if quiet_hours is None:
+        return "отключены"
+    start, end = quiet_hours
+    return f"{start.strftime('%H:%M')}-{end.strftime('%H:%M')}"
+
+async def release_bot_deferred(bot, limiter: RateLimiter, stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        deliveries = get_due_deferred(bot.id, DEFERRED_BATCH_SIZE)
+        if not deliveries:
+            return
+        logger.info(f"Releasing {len(deliveries)} deferred deliveries of bot {bot.id}")
+        released, failed = [], []
+        stats = StatsBatch()
+
+        async def release(delivery):
+            reminder_id, user_id, bot_id, text, media_type, media_file_id = delivery
+            await limiter.acquire()
+            try:
+                await sender.send(bot, user_id, text, media_type, media_file_id)
+                logger.info(f"Successfully sent deferred reminder {reminder_id} to user {user_id}")
+                stats.add(reminder_id, deferred=-1, sent=1, sent_at=get_moscow_time())
+            except Exception as e:
+                logger.error(f"Error sending deferred reminder {reminder_id} to user {user_id}: {e}")
+                if is_transient_error(e) and RETRY_MAX_ATTEMPTS > 1:
+                    failed.append(retry_entry(reminder_id, user_id, bot_id, text, media_type, media_file_id, 1, e))
+                    stats.add(reminder_id, deferred=-1, retrying=1)
+                else:
+                    stats.add(reminder_id, deferred=-1, failure=failure_reason(e))
+            released.append((reminder_id, user_id))
+
+        try:
+            await asyncio.gather(*(release(delivery) for delivery in deliveries))
+        finally:
+            add_retries(failed)
+            delete_deferred(released)
+            stats.flush()
+
+async def release_bot_deferred_loop(bot, stop_event: asyncio.Event):
+    # Отдельный цикл на бота, чтобы большая очередь одного бота не задерживала
+    # выпуск у остальных. Лимит скорости бота действует поверх общего пула,
+    # чтобы конец тихих часов не давал пика исходящих сообщений
+    limiter = RateLimiter(DEFERRED_RATE_LIMIT)
+    while not stop_event.is_set():
+        timeout = DEFERRED_POLL_INTERVAL
+        try:
+            await release_bot_deferred(bot, limiter, stop_event)
+            # Просыпаемся к ближайшей отложенной доставке
+            next_release = get_next_deferred_release(bot.id)
+            if next_release is not None:
+                timeout = max(DEFERRED_MIN_WAIT, min(timeout, (next_release - get_moscow_time()).total_seconds()))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error releasing deferred deliveries of bot {bot.id}: {e}")
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+async def release_deferred(bots, stop_event: asyncio.Event):
+    await asyncio.gather(*(release_bot_deferred_loop(bot, stop_event) for bot in bots.values()))
+    logger.info("Deferred delivery release stopped")
@@ -1,82 +1,334 @@
+import os
+import time
 import logging
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 from database import (
     get_pending_reminders,
     get_all_users,
+    count_users,
     delete_reminder,
+    save_reminder_progress,
+    add_retries,
+    add_deferred,
+    count_deferred,
+    get_users_quiet_hours,
+    init_reminder_stats,
     get_moscow_time,
     debug_print_reminders
 )
+from quiet_hours import quiet_hours_for, quiet_hours_end, release_time, release_deferred
+from retries import drain_retries, retry_entry, RETRY_MAX_ATTEMPTS
+from sender import sender, is_transient_error
+from stats import StatsBatch, failure_reason
 
 logger = logging.getLogger(__name__)
 
-async def send_missed_reminders(bot):
+# Как часто (в отправленных сообщениях) сохранять прогресс рассылки.
+# Сообщения одной пачки отправляются параллельно через общий пул
+CHECKPOINT_EVERY = 50
+# Максимальный интервал между проверками напоминаний, секунды
+CHECK_INTERVAL = 60
+# Окно вокруг времени напоминания (секунды), в которое должны уложиться
+# все получатели: рассылка центрируется на времени напоминания
+DELIVERY_WINDOW = float(os.getenv('DELIVERY_WINDOW', '120'))
+# Насколько раньше времени напоминания можно начать рассылку, секунды
+MAX_DISPATCH_LEAD = float(os.getenv('MAX_DISPATCH_LEAD', '3600'))
+# Минимум сообщений в рассылке, чтобы учитывать ее скорость в оценке
+MIN_THROUGHPUT_SAMPLE = 10
+
+def broadcast_duration(reminder, users_quiet_hours) -> float:
+    # Длительность рассылки по числу оставшихся получателей и измеренной
+    # скорости отправки бота. Получатели в тихих часах на время напоминания
+    # откладываются сразу и в оценку не входят
+    reminder_time = datetime.fromisoformat(reminder[3])
+    progress_user_id, bot_id = reminder[6], reminder[7]
+    recipients = count_users(bot_id, progress_user_id)
+    custom = [value for user_id, value in users_quiet_hours.items() if user_id > progress_user_id]
+    quiet = sum(1 for value in custom if quiet_hours_end(quiet_hours_for(value), reminder_time) is not None)
+    if quiet_hours_end(quiet_hours_for(None), reminder_time) is not None:
+        # Пользователи без своих настроек попадают в общие тихие часы
+        quiet += recipients - len(custom)
+    return max(recipients - quiet, 0) / sender.throughput(bot_id)
+
+def dispatch_times(reminders, users_quiet_hours):
+    # Время старта каждой рассылки из очереди одного бота (по возрастанию
+    # reminder_time). Рассылки бота идут по очереди, поэтому план строится с
+    # конца: рассылка центрируется на времени своего напоминания, но должна
+    # закончиться к старту следующей. Старт не раньше MAX_DISPATCH_LEAD
+    durations = [broadcast_duration(reminder, users_quiet_hours) for reminder in reminders]
+    starts = [None] * len(reminders)
+    next_start = None
+    for i in reversed(range(len(reminders))):
+        reminder_time = datetime.fromisoformat(reminders[i][3])
+        start = reminder_time - timedelta(seconds=durations[i] / 2)
+        if next_start is not None:
+            start = min(start, next_start - timedelta(seconds=durations[i]))
+        start = max(start, reminder_time - timedelta(seconds=MAX_DISPATCH_LEAD))
+        starts[i] = next_start = start
+    return starts
+
+def report_delivery_window(reminder_id: int, reminder_time: datetime, first_sent: datetime, last_sent: datetime):
+    window_start = reminder_time - timedelta(seconds=DELIVERY_WINDOW / 2)
+    window_end = reminder_time + timedelta(seconds=DELIVERY_WINDOW / 2)
+    early = max(0.0, (window_start - first_sent).total_seconds())
+    late = max(0.0, (last_sent - window_end).total_seconds())
+    if early or late:
+        logger.warning(
+            f"Reminder {reminder_id} missed delivery window of {DELIVERY_WINDOW:.0f}s: "
+            f"first recipient {early:.1f}s early, last recipient {late:.1f}s late"
+        )
+    else:
+        logger.info(
+            f"Reminder {reminder_id} delivered within window: "
+            f"{(first_sent - reminder_time).total_seconds():+.1f}s .. {(last_sent - reminder_time).total_seconds():+.1f}s"
+        )
+
+async def broadcast_reminder(bot, reminder, header: str) -> bool:
+    reminder_id, owner_id, text, reminder_time, media_type, media_file_id, progress_user_id, _ = reminder
+    logger.info(f"Processing reminder {reminder_id} of bot {bot.id}: {text}")
+
+    # После прерванной рассылки продолжаем со следующего пользователя
+    users = [user_id for user_id in get_all_users(bot.id) if user_id > progress_user_id]
+    logger.info(f"Found {len(users)} users to send reminder {reminder_id} to")
+    if not users and not progress_user_id:
+        logger.warning("No users found in database, skipping reminder")
+        return False
+    if progress_user_id:
+        logger.info(f"Resuming reminder {reminder_id} after user {progress_user_id}")
+
+    message_text = f"{header}\n\n{text}"
+    users_quiet_hours = get_users_quiet_hours(bot.id)
+    # Размер очереди отложенных доставок бота вместе с получателями этой
+    # рассылки в тихих часах: по нему растягивается окно их выпуска
+    now = get_moscow_time()
+    deferred_backlog = count_deferred(bot.id) + sum(
+        1 for user_id in users if quiet_hours_end(quiet_hours_for(users_quiet_hours.get(user_id)), now) is not None
+    )
+    init_reminder_stats(reminder_id, bot.id, owner_id, text, reminder_time, len(users))
+    # Итог доставки каждому получателю текущей пачки для статистики
+    outcomes = {}
+    done = set()
+    sent_times = []
+    failed = []
+    deferred = []
+    quiet_users = set()
+
+    async def send_to(user_id: int):
+        # Получателям в тихие часы доставка откладывается до их окончания
+        quiet_end = quiet_hours_end(quiet_hours_for(users_quiet_hours.get(user_id)), get_moscow_time())
+        if quiet_end is not None:
+            deferred.append((
+                reminder_id, user_id, bot.id, message_text, media_type, media_file_id, release_time(quiet_end, deferred_backlog)
+            ))
+            quiet_users.add(user_id)
+            outcomes[user_id] = {'deferred': 1}
+            done.add(user_id)
+            return
+        try:
+            logger.info(f"Attempting to send reminder {reminder_id} to user {user_id}")
+            await sender.send(bot, user_id, message_text, media_type, media_file_id)
+            sent_at = get_moscow_time()
+            sent_times.append(sent_at)
+            outcomes[user_id] = {'sent': 1, 'sent_at': sent_at}
+            logger.info(f"Successfully sent reminder {reminder_id} to user {user_id}")
+        except Exception as e:
+            logger.error(f"Error sending reminder {reminder_id} to user {user_id}: {e}")
+            # Временные сбои уходят в очередь повторов, остальные не повторяем
+            if is_transient_error(e) and RETRY_MAX_ATTEMPTS > 1:
+                failed.append(retry_entry(
+                    reminder_id, user_id, bot.id, message_text, media_type, media_file_id, 1, e
+                ))
+                outcomes[user_id] = {'retrying': 1}
+            else:
+                outcomes[user_id] = {'failure': failure_reason(e)}
+        done.add(user_id)
+
+    def flush_stats(user_ids):
+        stats = StatsBatch()
+        for user_id in user_ids:
+            stats.add(reminder_id, **outcomes.pop(user_id, {}))
+        stats.flush()
+
+    last_user_id = progress_user_id
+    batch = []
+    started = time.monotonic()
+    try:
+        for start in range(0, len(users), CHECKPOINT_EVERY):
+            batch = users[start:start + CHECKPOINT_EVERY]
+            await asyncio.gather(*(send_to(user_id) for user_id in batch))
+            # Контрольная точка и очереди повторов и отложенных доставок
+            # пишутся пачками, а не после каждого сообщения
+            last_user_id = batch[-1]
+            add_retries(failed)
+            add_deferred(deferred)
+            flush_stats(batch)
+            failed.clear()
+            deferred.clear()
+            save_reminder_progress(reminder_id, last_user_id)
+    except asyncio.CancelledError:
+        # Рассылку прервали при остановке бота: сохраняем прогресс до первого
+        # неотправленного пользователя, чтобы после перезапуска продолжить с него
+        for user_id in batch:
+            if user_id not in done:
+                break
+            last_user_id = user_id
+        # Получателей после контрольной точки перезапуск обработает заново
+        add_retries([entry for entry in failed if entry[1] <= last_user_id])
+        add_deferred([entry for entry in deferred if entry[1] <= last_user_id])
+        flush_stats([user_id for user_id in batch if user_id <= last_user_id])
+        if last_user_id != progress_user_id:
+            save_reminder_progress(reminder_id, last_user_id)
+        logger.warning(f"Reminder {reminder_id} interrupted after user {last_user_id}")
+        raise
+
+    elapsed = time.monotonic() - started
+    attempted = len(users) - len(quiet_users)
+    if attempted >= MIN_THROUGHPUT_SAMPLE and elapsed > 0:
+        sender.record_throughput(bot.id, attempted / elapsed)
+    if sent_times:
+        report_delivery_window(reminder_id, datetime.fromisoformat(reminder_time), min(sent_times), max(sent_times))
+
+    if delete_reminder(reminder_id):
+        logger.info(f"Successfully deleted reminder {reminder_id} after sending")
+        return True
+    logger.error(f"Failed to delete reminder {reminder_id}")
+    return False
+
+async def process_bot_reminders(bot, reminders, header: str, stop_event: asyncio.Event = None):
+    # Возвращает id напоминаний, которые не удалось разослать и удалить
+    failed = []
+    for reminder in reminders:
+        # При остановке дорассылаем текущее напоминание, но новые не начинаем
+        if stop_event is not None and stop_event.is_set():
+            break
+        try:
+            if not await broadcast_reminder(bot, reminder, header):
+                failed.append(reminder[0])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing reminder {reminder[0]}: {e}")
+            failed.append(reminder[0])
+    return failed
+
+async def process_reminders(bots, reminders, header: str, stop_event: asyncio.Event = None):
+    # Напоминания одного бота рассылаются по очереди, разных ботов - параллельно
+    by_bot = {}
+    for reminder in reminders:
+        by_bot.setdefault(reminder[7], []).append(reminder)
+
+    tasks = []
+    for bot_id, bot_reminders in by_bot.items():
+        if bot_id not in bots:
+            logger.warning(f"Bot {bot_id} is not configured, skipping {len(bot_reminders)} reminders")
+            continue
+        tasks.append(process_bot_reminders(bots[bot_id], bot_reminders, header, stop_event))
+    await asyncio.gather(*tasks)
+
+async def send_missed_reminders(bots, stop_event: asyncio.Event = None):
     try:
         logger.info("Checking for missed reminders...")
         reminders = get_pending_reminders()
         logger.info(f"Found {len(reminders)} missed reminders")
 
-        if reminders:
-            users = get_all_users()
-            logger.info(f"Found {len(users)} users to send reminders to")
-            
-            for reminder_id, user_id, text, reminder_time in reminders:
-                logger.info(f"Processing reminder {reminder_id}: {text}")
-                for user_id in users:
-                    try:
-                        logger.info(f"Attempting to send reminder {reminder_id} to user {user_id}")
-                        await bot.send_message(
-                            user_id,
-                            f"🔔 Пропущенное напоминание!\n\n{text}"
-                        )
-                        logger.info(f"Successfully sent reminder {reminder_id} to user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Error sending missed reminder to user {user_id}: {e}")
-                if delete_reminder(reminder_id):
-                    logger.info(f"Successfully deleted reminder {reminder_id} after sending")
-                else:
-                    logger.error(f"Failed to delete reminder {reminder_id}")
-        else:
+        if not reminders:
             logger.info("No missed reminders found")
+        await process_reminders(bots, reminders, "🔔 Пропущенное напоминание!", stop_event)
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         logger.error(f"Error sending missed reminders: {e}")
 
-async def check_reminders(bot):
-    while True:
-        try:
-            logger.info("Checking for pending reminders...")
-            reminders = get_pending_reminders()
-            logger.info(f"Found {len(reminders)} pending reminders")
-            
-            for reminder_id, user_id, text, reminder_time in reminders:
-                try:
-                    logger.info(f"Processing reminder {reminder_id}: {text}")
-                    users = get_all_users()
-                    logger.info(f"Found {len(users)} users to send reminders to")
-                    
-                    if not users:
-                        logger.warning("No users found in database, skipping reminder")
+async def check_reminders(bots, stop_event: asyncio.Event):
+    # Один планировщик на все боты процесса. Рассылки выполняются в отдельных
+    # задачах (не больше одной на бота), чтобы планировщик мог вовремя начать
+    # заблаговременную рассылку другого бота
+    active = {}
+    # Напоминания, рассылка которых не удалась: reminder_id -> время, раньше
+    # которого их не берем снова. Иначе напоминание без получателей или с
+    # ошибкой удаления рассылалось бы заново сразу после завершения задачи
+    postponed = {}
+    stop_waiter = asyncio.create_task(stop_event.wait())
+    try:
+        while not stop_event.is_set():
+            timeout = CHECK_INTERVAL
+            try:
+                for bot_id, task in list(active.items()):
+                    if task.done():
+                        del active[bot_id]
+                        if not task.cancelled() and task.exception() is None:
+                            retry_at = get_moscow_time() + timedelta(seconds=CHECK_INTERVAL)
+                            for reminder_id in task.result():
+                                postponed[reminder_id] = retry_at
+
+                logger.info("Checking for pending reminders...")
+                reminders = get_pending_reminders(lookahead=MAX_DISPATCH_LEAD)
+                logger.info(f"Found {len(reminders)} upcoming reminders")
+
+                now = get_moscow_time()
+                pending_ids = {reminder[0] for reminder in reminders}
+                for reminder_id, retry_at in list(postponed.items()):
+                    if retry_at <= now or reminder_id not in pending_ids:
+                        del postponed[reminder_id]
+
+                queues = {}
+                for reminder in reminders:
+                    bot_id = reminder[7]
+                    if bot_id in active:
                         continue
-                        
-                    for user_id in users:
-                        try:
-                            logger.info(f"Attempting to send reminder {reminder_id} to user {user_id}")
-                            await bot.send_message(
-                                user_id,
-                                f"🔔 Напоминание!\n\n{text}"
-                            )
-                            logger.info(f"Successfully sent reminder {reminder_id} to user {user_id}")
-                        except Exception as e:
-                            logger.error(f"Error sending reminder to user {user_id}: {e}")
-                    
-                    if delete_reminder(reminder_id):
-                        logger.info(f"Successfully deleted reminder {reminder_id} after sending")
-                    else:
-                        logger.error(f"Failed to delete reminder {reminder_id}")
-                except Exception as e:
-                    logger.error(f"Error processing reminder {reminder_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error in check_reminders loop: {e}")
-        await asyncio.sleep(60)  # Проверяем каждую минуту 
\ No newline at end of file
+                    if reminder[0] in postponed:
+                        timeout = min(timeout, (postponed[reminder[0]] - now).total_seconds())
+                        continue
+                    if bot_id not in bots:
+                        logger.warning(f"Bot {bot_id} is not configured, skipping reminder {reminder[0]}")
+                        continue
+                    queues.setdefault(bot_id, []).append(reminder)
+
+                for bot_id, queue in queues.items():
+                    # Время старта по очереди не убывает: готово начало очереди
+                    ready = []
+                    for reminder, start_at in zip(queue, dispatch_times(queue, get_users_quiet_hours(bot_id))):
+                        if start_at > now:
+                            # Просыпаемся точно к началу следующей рассылки
+                            timeout = min(timeout, (start_at - now).total_seconds())
+                            break
+                        ready.append(reminder)
+                    if ready:
+                        active[bot_id] = asyncio.create_task(
+                            process_bot_reminders(bots[bot_id], ready, "🔔 Напоминание!", stop_event)
+                        )
+            except Exception as e:
+                logger.error(f"Error in check_reminders loop: {e}")
+
+            # Ждем следующей проверки, окончания одной из рассылок или остановки
+            await asyncio.wait(
+                [stop_waiter, *active.values()],
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+        # При остановке дожидаемся текущих рассылок
+        await asyncio.gather(*active.values())
+    finally:
+        stop_waiter.cancel()
+        # Если планировщик прервали по таймауту остановки, прерываем и рассылки:
+        # они сохранят прогресс в обработчике CancelledError
+        for task in active.values():
+            task.cancel()
+        await asyncio.gather(*active.values(), return_exceptions=True)
+    logger.info("Reminder checker stopped")
+
+async def run_reminders(bots, stop_event: asyncio.Event):
+    async def send_reminders():
+        await send_missed_reminders(bots, stop_event)
+        await check_reminders(bots, stop_event)
+
+    # Досылка после временных сбоев и выпуск отложенных на тихие часы
+    # доставок идут параллельно с основными рассылками
+    await asyncio.gather(
+        send_reminders(),
+        drain_retries(bots, stop_event),
+        release_deferred(bots, stop_event)
+    )
@@ -0,0 +1,82 @@
+import os
+import random
+import asyncio
+import logging
+from datetime import timedelta
+
+from database import add_retries, get_due_retries, delete_retries, get_moscow_time
+from sender import sender, is_transient_error
+from stats import StatsBatch, failure_reason
+
+logger = logging.getLogger(__name__)
+
+# Максимум попыток доставки одному получателю, включая основную рассылку
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+# Задержка перед первой повторной попыткой и ее верхняя граница, секунды
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '30'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '3600'))
+# Как часто проверять очередь и сколько попыток брать за раз
+RETRY_POLL_INTERVAL = 10
+RETRY_BATCH_SIZE = 100
+
+def retry_delay(attempts: int) -> float:
+    # Экспоненциальная задержка со случайным разбросом в верхней половине
+    # интервала, чтобы повторы после массового сбоя не шли одной волной
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def retry_entry(reminder_id: int, user_id: int, bot_id: int, text: str,
+                media_type: str, media_file_id: str, attempts: int, error: Exception):
+    # Запись для add_retries после неудачной попытки номер attempts
+    next_attempt_at = get_moscow_time() + timedelta(seconds=retry_delay(attempts))
+    return (reminder_id, user_id, bot_id, text, media_type, media_file_id,
+            attempts, next_attempt_at, str(error))
+
+async def retry_delivery(bot, retry, delivered, rescheduled, stats: StatsBatch):
+    reminder_id, user_id, bot_id, text, media_type, media_file_id, attempts = retry
+    try:
+        await sender.send(bot, user_id, text, media_type, media_file_id)
+        logger.info(f"Successfully resent reminder {reminder_id} to user {user_id} (attempt {attempts + 1})")
+        delivered.append((reminder_id, user_id))
+        stats.add(reminder_id, retrying=-1, sent=1, sent_at=get_moscow_time())
+    except Exception as e:
+        attempts += 1
+        if is_transient_error(e) and attempts < RETRY_MAX_ATTEMPTS:
+            logger.warning(f"Retry {attempts} of reminder {reminder_id} to user {user_id} failed: {e}")
+            rescheduled.append(retry_entry(reminder_id, user_id, bot_id, text, media_type, media_file_id, attempts, e))
+        else:
+            logger.error(f"Giving up on reminder {reminder_id} for user {user_id} after {attempts} attempts: {e}")
+            delivered.append((reminder_id, user_id))
+            stats.add(reminder_id, retrying=-1, failure=failure_reason(e))
+
+async def drain_retries(bots, stop_event: asyncio.Event):
+    # Фоновая досылка. Отправка идет через общий пул с лимитом скорости бота,
+    # поэтому повторы делят бюджет с основной рассылкой, но не блокируют ее
+    while not stop_event.is_set():
+        try:
+            retries = get_due_retries(bots.keys(), RETRY_BATCH_SIZE)
+            if retries:
+                logger.info(f"Retrying {len(retries)} failed deliveries")
+                delivered, rescheduled = [], []
+                stats = StatsBatch()
+                try:
+                    await asyncio.gather(*(
+                        retry_delivery(bots[retry[2]], retry, delivered, rescheduled, stats) for retry in retries
+                    ))
+                finally:
+                    # Результаты пишутся пачкой, в том числе при остановке
+                    delete_retries(delivered)
+                    add_retries(rescheduled)
+                    stats.flush()
+                if len(retries) == RETRY_BATCH_SIZE:
+                    continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in drain_retries loop: {e}")
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=RETRY_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    logger.info("Retry drainer stopped")
@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина подписи к фото/документу в Telegram
+CAPTION_LIMIT = 1024
+# Ограничение Telegram на рассылку - около 30 сообщений в секунду на бота
+BOT_RATE_LIMIT = float(os.getenv('BOT_RATE_LIMIT', '25'))
+# Сколько сообщений всех ботов процесса может отправляться одновременно
+SENDER_CONCURRENCY = int(os.getenv('SENDER_CONCURRENCY', '20'))
+# Вес последней рассылки в сглаженной оценке скорости отправки
+THROUGHPUT_SMOOTHING = 0.5
+# Сколько раз и сколько секунд суммарно ждать по RetryAfter, прежде чем
+# отдать ошибку вызывающему коду (и получателя - в очередь повторов)
+RETRY_AFTER_MAX_ATTEMPTS = 3
+RETRY_AFTER_MAX_WAIT = 60
+
+async def send_reminder(bot, chat_id: int, text: str, media_type: str = None, media_file_id: str = None):
+    # Вложение отправляется по file_id, сохраненному при создании напоминания,
+    # поэтому файл не загружается заново для каждого получателя
+    if not media_type:
+        return await bot.send_message(chat_id, text)
+
+    caption = text if len(text) <= CAPTION_LIMIT else None
+    if media_type == 'photo':
+        result = await bot.send_photo(chat_id, media_file_id, caption=caption)
+    elif media_type == 'document':
+        result = await bot.send_document(chat_id, media_file_id, caption=caption)
+    else:
+        raise ValueError(f"Unknown media type: {media_type}")
+
+    if caption is None:
+        await bot.send_message(chat_id, text)
+    return result
+
+def is_transient_error(error: Exception) -> bool:
+    # Сетевые сбои и ошибки 5xx имеет смысл повторить. Остальные ошибки
+    # (бот заблокирован, чат не найден и т.п.) повтором не исправить
+    return isinstance(
+        error,
+        (TelegramNetworkError, TelegramServerError, TelegramRetryAfter, asyncio.TimeoutError)
+    )
+
+class RateLimiter:
+    # Равномерный лимит: каждый вызов acquire() резервирует следующий слот
+    # через 1/rate секунд после предыдущего
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def wait(self):
+        # Дождаться следующего слота, не резервируя его
+        delay = self._next_slot - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def take(self) -> bool:
+        # Занять слот, если он уже наступил
+        now = time.monotonic()
+        if now < self._next_slot:
+            return False
+        self._next_slot = now + self.interval
+        return True
+
+    def pause(self, seconds: float):
+        # Telegram прислал RetryAfter: откладываем все следующие отправки бота
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+class Sender:
+    # Общий пул отправки для всех ботов процесса: глобальное ограничение
+    # одновременных запросов и отдельный лимит скорости на каждого бота
+    def __init__(self, concurrency: int = SENDER_CONCURRENCY, rate: float = BOT_RATE_LIMIT):
+        self.rate = rate
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limiters: Dict[int, RateLimiter] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._throughput: Dict[int, float] = {}
+
+    def limiter(self, bot_id: int) -> RateLimiter:
+        if bot_id not in self._limiters:
+            self._limiters[bot_id] = RateLimiter(self.rate)
+        return self._limiters[bot_id]
+
+    async def _acquire(self, bot_id: int):
+        # Слот скорости занимается уже под семафором, в момент отправки: иначе
+        # отправки бота, дождавшиеся слота, пока семафор заняли другие боты,
+        # уходили бы подряд, а RetryAfter не останавливал бы уже прошедших
+        # лимит. Слот ждет одна отправка бота, остальные - на блокировке
+        limiter = self.limiter(bot_id)
+        if bot_id not in self._locks:
+            self._locks[bot_id] = asyncio.Lock()
+        async with self._locks[bot_id]:
+            while True:
+                await limiter.wait()
+                await self._semaphore.acquire()
+                if limiter.take():
+                    return
+                # Пока ждали семафор, бот получил RetryAfter
+                self._semaphore.release()
+
+    def record_throughput(self, bot_id: int, messages_per_second: float):
+        previous = self._throughput.get(bot_id)
+        if previous is None:
+            self._throughput[bot_id] = messages_per_second
+        else:
+            self._throughput[bot_id] = (
+                THROUGHPUT_SMOOTHING * messages_per_second + (1 - THROUGHPUT_SMOOTHING) * previous
+            )
+
+    def throughput(self, bot_id: int) -> float:
+        # Измеренная скорость рассылок бота, до первой рассылки - лимит скорости
+        return self._throughput.get(bot_id, self.rate)
+
+    async def send(self, bot, chat_id: int, text: str, media_type: str = None, media_file_id: str = None):
+        limiter = self.limiter(bot.id)
+        attempts = 0
+        waited = 0
+        while True:
+            await self._acquire(bot.id)
+            try:
+                return await send_reminder(bot, chat_id, text, media_type, media_file_id)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Bot {bot.id} is rate limited by Telegram for {e.retry_after}s")
+                limiter.pause(e.retry_after)
+                attempts += 1
+                waited += e.retry_after
+                if attempts >= RETRY_AFTER_MAX_ATTEMPTS or waited > RETRY_AFTER_MAX_WAIT:
+                    raise
+            finally:
+                self._semaphore.release()
+
+sender = Sender()
@@ -0,0 +1,44 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import update_reminder_stats
+
+logger = logging.getLogger(__name__)
+
+SENT, DEFERRED, RETRYING, FAILED, FIRST_SENT, LAST_SENT = range(6)
+
+def failure_reason(error: Exception) -> str:
+    # Класс исключения aiogram: конечный набор причин вместо текста ошибки
+    return type(error).__name__
+
+class StatsBatch:
+    # Накопитель приращений статистики доставки в памяти. Пишется в базу
+    # одним flush() на пачку получателей, а не после каждого сообщения
+    def __init__(self):
+        self._counters: Dict[int, List] = {}
+        self._failures: Dict[tuple, int] = {}
+
+    def add(self, reminder_id: int, sent: int = 0, deferred: int = 0, retrying: int = 0,
+            failure: Optional[str] = None, sent_at: Optional[datetime] = None):
+        counters = self._counters.setdefault(reminder_id, [0, 0, 0, 0, None, None])
+        counters[SENT] += sent
+        counters[DEFERRED] += deferred
+        counters[RETRYING] += retrying
+        if failure is not None:
+            counters[FAILED] += 1
+            key = (reminder_id, failure)
+            self._failures[key] = self._failures.get(key, 0) + 1
+        if sent_at is not None:
+            sent_at = sent_at.isoformat()
+            if counters[FIRST_SENT] is None or sent_at < counters[FIRST_SENT]:
+                counters[FIRST_SENT] = sent_at
+            if counters[LAST_SENT] is None or sent_at > counters[LAST_SENT]:
+                counters[LAST_SENT] = sent_at
+
+    def flush(self) -> bool:
+        increments = [tuple(counters) + (reminder_id,) for reminder_id, counters in self._counters.items()]
+        failures = [key + (count,) for key, count in self._failures.items()]
+        self._counters.clear()
+        self._failures.clear()
+        return update_reminder_stats(increments, failures)
@@ -0,0 +1,47 @@
+import os
+import re
+import logging
+from typing import Dict, List, Set, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Администраторы каждого бота: bot_id -> множество user_id
+_admins: Dict[int, Set[int]] = {}
+
+def parse_admin_ids(value: str) -> Set[int]:
+    return {int(admin_id) for admin_id in value.replace(' ', '').split(',') if admin_id}
+
+def load_tenants() -> List[Tuple[str, Set[int]]]:
+    # Основной бот задается BOT_TOKEN/ADMIN_ID, дополнительные -
+    # BOT_TOKEN_2/ADMIN_ID_2, BOT_TOKEN_3/ADMIN_ID_3 и т.д.
+    # ADMIN_ID может содержать несколько id через запятую, пустой токен
+    # отключает бота
+    tenants = []
+    if os.getenv('BOT_TOKEN'):
+        tenants.append((os.getenv('BOT_TOKEN'), parse_admin_ids(os.getenv('ADMIN_ID', ''))))
+
+    suffixes = sorted(
+        int(match.group(1))
+        for match in (re.fullmatch(r'BOT_TOKEN_(\d+)', key) for key in os.environ)
+        if match
+    )
+    for suffix in suffixes:
+        if not os.environ[f'BOT_TOKEN_{suffix}']:
+            continue
+        tenants.append((
+            os.environ[f'BOT_TOKEN_{suffix}'],
+            parse_admin_ids(os.getenv(f'ADMIN_ID_{suffix}', ''))
+        ))
+    return tenants
+
+def register_admins(bot_id: int, admin_ids: Set[int]):
+    if not admin_ids:
+        logger.warning(f"No admins configured for bot {bot_id}")
+    _admins[bot_id] = set(admin_ids)
+
+def is_admin(bot_id: int, user_id: int) -> bool:
+    return user_id in _admins.get(bot_id, ())
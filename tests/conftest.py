@@ -0,0 +1,10 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # Отдельная база на каждый тест
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'reminders.db'))
+    database.init_db()
@@ -0,0 +1,38 @@
+import asyncio
+from datetime import timedelta
+
+import database
+import reminders
+
+
+class FakeBot:
+    id = 7
+
+
+def test_reminder_without_users_is_not_redispatched(db, monkeypatch):
+    # Бот без пользователей и просроченное напоминание: broadcast_reminder
+    # возвращает False, и планировщик не должен крутиться в цикле
+    database.add_reminder(FakeBot.id, 1, 'test', database.get_moscow_time() - timedelta(minutes=1))
+
+    checks = 0
+    get_pending_reminders = reminders.get_pending_reminders
+
+    def counting_get_pending_reminders(*args, **kwargs):
+        nonlocal checks
+        checks += 1
+        return get_pending_reminders(*args, **kwargs)
+
+    monkeypatch.setattr(reminders, 'get_pending_reminders', counting_get_pending_reminders)
+
+    async def run():
+        stop_event = asyncio.Event()
+        checker = asyncio.create_task(reminders.check_reminders({FakeBot.id: FakeBot()}, stop_event))
+        await asyncio.sleep(1)
+        stop_event.set()
+        await checker
+
+    asyncio.run(run())
+    # Первая проверка запускает рассылку, вторая - после ее завершения
+    # откладывает напоминание на CHECK_INTERVAL
+    assert checks <= 2
+    assert len(database.get_pending_reminders()) == 1
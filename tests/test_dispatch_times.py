@@ -0,0 +1,36 @@
+from datetime import time, timedelta
+
+import database
+import quiet_hours
+import reminders
+
+BOT_ID = 7
+
+
+def add_queue(users, count):
+    for user_id in range(1, users + 1):
+        database.add_or_update_user(BOT_ID, user_id)
+    reminder_time = database.get_moscow_time().replace(hour=12, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    for _ in range(count):
+        database.add_reminder(BOT_ID, 1, 'test', reminder_time)
+    return reminder_time, database.get_pending_reminders(lookahead=2 * 86400)
+
+
+def test_queue_of_one_bot_is_planned_backwards(db, monkeypatch):
+    # 1000 получателей при 25 сообщениях в секунду - 40 секунд на рассылку.
+    # Второе напоминание на то же время стартует только после первого
+    monkeypatch.setattr(reminders.sender, '_throughput', {BOT_ID: 25})
+    reminder_time, queue = add_queue(1000, 2)
+    starts = reminders.dispatch_times(queue, database.get_users_quiet_hours(BOT_ID))
+    assert [reminder_time - start for start in starts] == [timedelta(seconds=60), timedelta(seconds=20)]
+
+
+def test_quiet_hours_recipients_do_not_extend_lead(db, monkeypatch):
+    monkeypatch.setattr(reminders.sender, '_throughput', {BOT_ID: 25})
+    monkeypatch.setattr(quiet_hours, 'GLOBAL_QUIET_HOURS', (time(11, 0), time(13, 0)))
+    reminder_time, queue = add_queue(1000, 1)
+    # Половина пользователей отключила тихие часы
+    for user_id in range(1, 501):
+        database.set_user_quiet_hours(BOT_ID, user_id, '')
+    starts = reminders.dispatch_times(queue, database.get_users_quiet_hours(BOT_ID))
+    assert reminder_time - starts[0] == timedelta(seconds=10)
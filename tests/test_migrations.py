@@ -0,0 +1,62 @@
+import sqlite3
+from datetime import timedelta
+
+import database
+
+BASELINE_SCHEMA = '''
+    CREATE TABLE reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        reminder_time TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_sent BOOLEAN DEFAULT 0
+    );
+    CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+
+def test_baseline_database_is_claimed_by_main_bot(tmp_path, monkeypatch):
+    # База версии с одним ботом: users с ключом по user_id, reminders без bot_id
+    path = tmp_path / 'reminders.db'
+    monkeypatch.setattr(database, 'DB_PATH', str(path))
+    reminder_time = (database.get_moscow_time() + timedelta(hours=1)).isoformat()
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+        [(user_id, f'user{user_id}', f'User{user_id}') for user_id in (3, 1, 2)]
+    )
+    conn.execute('INSERT INTO reminders (user_id, text, reminder_time) VALUES (1, ?, ?)', ('legacy', reminder_time))
+    conn.commit()
+    conn.close()
+
+    database.init_db()
+    # Повторный запуск не должен ничего менять
+    database.init_db()
+    database.claim_legacy_rows(7)
+
+    assert database.get_all_users(7) == [1, 2, 3]
+    assert database.get_all_users(0) == []
+    reminders = database.get_pending_reminders(lookahead=7200)
+    assert [(reminder[1], reminder[2], reminder[3], reminder[7]) for reminder in reminders] == [
+        (1, 'legacy', reminder_time, 7)
+    ]
+
+    conn = database.get_connection()
+    primary_key = sorted((row[5], row[1]) for row in conn.execute('PRAGMA table_info(users)') if row[5])
+    username = conn.execute('SELECT username FROM users WHERE bot_id = 7 AND user_id = 2').fetchone()[0]
+    conn.close()
+    assert [column for _, column in primary_key] == ['bot_id', 'user_id']
+    assert username == 'user2'
+
+    # Тот же пользователь у другого бота - отдельная запись
+    assert database.add_or_update_user(8, 1)
+    assert database.get_all_users(7) == [1, 2, 3]
+    assert database.get_all_users(8) == [1]
@@ -0,0 +1,42 @@
+import time
+import asyncio
+from datetime import timedelta
+
+import database
+import quiet_hours
+
+
+class FakeBot:
+    def __init__(self, bot_id):
+        self.id = bot_id
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, time.monotonic()))
+
+
+def test_large_backlog_does_not_delay_other_bots(db, monkeypatch):
+    # У бота 1 большая очередь после тихих часов, у бота 2 одна доставка,
+    # которая становится готовой через секунду
+    monkeypatch.setattr(quiet_hours, 'DEFERRED_RATE_LIMIT', 50)
+    now = database.get_moscow_time()
+    database.add_deferred([
+        (1, user_id, 1, 'test', None, None, now - timedelta(seconds=1)) for user_id in range(1, 251)
+    ])
+    database.add_deferred([(2, 1, 2, 'test', None, None, now + timedelta(seconds=1))])
+    bots = {1: FakeBot(1), 2: FakeBot(2)}
+
+    async def run():
+        stop_event = asyncio.Event()
+        started = time.monotonic()
+        release = asyncio.create_task(quiet_hours.release_deferred(bots, stop_event))
+        while not bots[2].sent and time.monotonic() - started < 10:
+            await asyncio.sleep(0.1)
+        stop_event.set()
+        await release
+        return started
+
+    started = asyncio.run(run())
+    assert bots[2].sent
+    assert bots[2].sent[0][1] - started < 3
+    assert len(bots[1].sent) < 250
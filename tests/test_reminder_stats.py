@@ -0,0 +1,36 @@
+import asyncio
+from datetime import timedelta
+
+import database
+import reminders
+from sender import Sender
+
+
+class FakeBot:
+    id = 7
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(0.01)
+
+
+def test_targeted_is_audience_size_during_broadcast(db, monkeypatch):
+    monkeypatch.setattr(reminders, 'sender', Sender(rate=1000))
+    for user_id in range(1, 121):
+        database.add_or_update_user(FakeBot.id, user_id)
+    reminder_id = database.add_reminder(FakeBot.id, 1, 'test', database.get_moscow_time() - timedelta(minutes=1))
+
+    async def run():
+        # Прерываем рассылку после первой контрольной точки
+        broadcast = asyncio.create_task(
+            reminders.broadcast_reminder(FakeBot(), database.get_pending_reminders()[0], 'header')
+        )
+        while database.get_pending_reminders()[0][6] == 0:
+            await asyncio.sleep(0.01)
+        broadcast.cancel()
+        await asyncio.gather(broadcast, return_exceptions=True)
+
+    asyncio.run(run())
+    stats, _ = database.get_reminder_stats([reminder_id])
+    targeted, sent, deferred, retrying, failed = stats[reminder_id][:5]
+    assert targeted == 120
+    assert 0 < sent + deferred + retrying + failed < 120
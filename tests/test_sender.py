@@ -0,0 +1,58 @@
+import time
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from sender import Sender
+
+
+class FakeBot:
+    def __init__(self, bot_id, delay=0.0, retry_after=None):
+        self.id = bot_id
+        self.delay = delay
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(time.monotonic())
+        if self.retry_after is not None:
+            retry_after, self.retry_after = self.retry_after, None
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), 'Flood control', retry_after)
+        await asyncio.sleep(self.delay)
+
+
+def gaps(times):
+    times = sorted(times)
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_rate_limit_holds_while_other_bot_occupies_pool():
+    # Пока медленный бот занимает весь пул, отправки второго бота не должны
+    # накопиться и уйти подряд после освобождения пула
+    slow, fast = FakeBot(1, delay=0.5), FakeBot(2)
+    sender = Sender(concurrency=2, rate=10)
+
+    async def run():
+        await asyncio.gather(
+            *(sender.send(slow, user_id, 'test') for user_id in range(2)),
+            *(sender.send(fast, user_id, 'test') for user_id in range(5))
+        )
+
+    asyncio.run(run())
+    assert len(fast.sent) == 5
+    assert min(gaps(fast.sent)) >= 0.09
+
+
+def test_retry_after_pauses_waiting_sends():
+    bot = FakeBot(1, retry_after=1)
+    sender = Sender(concurrency=5, rate=100)
+
+    async def run():
+        await asyncio.gather(*(sender.send(bot, user_id, 'test') for user_id in range(3)))
+
+    asyncio.run(run())
+    # Первая отправка получила RetryAfter, следующие ждали паузу
+    assert len(bot.sent) == 4
+    assert max(gaps(bot.sent)) >= 0.99
+    assert sorted(gaps(bot.sent))[-2] < 0.5
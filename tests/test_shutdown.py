@@ -0,0 +1,125 @@
+import asyncio
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import SendMessage
+
+import database
+import reminders
+from sender import Sender
+
+BOT_ID = 7
+USERS = range(1, 301)
+
+
+class FakeBot:
+    # Каждому седьмому пользователю отправка не проходит из-за сбоя сети
+    id = BOT_ID
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(0.005)
+        if chat_id % 7 == 0:
+            raise TelegramNetworkError(SendMessage(chat_id=chat_id, text=text), 'Network error')
+        self.sent.append(chat_id)
+
+
+def setup_broadcast(monkeypatch):
+    monkeypatch.setattr(reminders, 'sender', Sender(concurrency=10, rate=1000))
+    now = database.get_moscow_time()
+    # Каждый пятый пользователь сейчас в тихих часах
+    quiet = f"{(now - timedelta(hours=1)).strftime('%H:%M')}-{(now + timedelta(hours=1)).strftime('%H:%M')}"
+    for user_id in USERS:
+        database.add_or_update_user(BOT_ID, user_id)
+        if user_id % 5 == 0:
+            database.set_user_quiet_hours(BOT_ID, user_id, quiet)
+    database.add_reminder(BOT_ID, 1, 'test', now - timedelta(minutes=1))
+
+
+def queued_users(table):
+    conn = database.get_connection()
+    users = [row[0] for row in conn.execute(f'SELECT user_id FROM {table}')]
+    conn.close()
+    return users
+
+
+def assert_no_recipient_dropped(*bots):
+    sent = [user_id for bot in bots for user_id in bot.sent]
+    retrying = queued_users('retry_queue')
+    deferred = queued_users('deferred_queue')
+    assert set(sent) | set(retrying) | set(deferred) == set(USERS)
+    assert set(retrying) == {user_id for user_id in USERS if user_id % 7 == 0 and user_id % 5}
+    assert set(deferred) == {user_id for user_id in USERS if user_id % 5 == 0}
+
+
+async def wait_for_sent(bot, count):
+    async def sent():
+        while len(bot.sent) < count:
+            await asyncio.sleep(0.001)
+
+    await asyncio.wait_for(sent(), timeout=10)
+
+
+def test_cancelled_broadcast_resumes_from_checkpoint(db, monkeypatch):
+    setup_broadcast(monkeypatch)
+    first, second = FakeBot(), FakeBot()
+
+    async def run():
+        # Прерываем посреди третьей пачки получателей
+        broadcast = asyncio.create_task(
+            reminders.broadcast_reminder(first, database.get_pending_reminders()[0], 'header')
+        )
+        await wait_for_sent(first, 110)
+        broadcast.cancel()
+        await asyncio.gather(broadcast, return_exceptions=True)
+
+        reminder = database.get_pending_reminders()[0]
+        assert 0 < reminder[6] < max(USERS)
+        assert await reminders.broadcast_reminder(second, reminder, 'header')
+
+    asyncio.run(run())
+    assert database.get_pending_reminders() == []
+    assert_no_recipient_dropped(first, second)
+
+
+def test_shutdown_drains_current_broadcast(db, monkeypatch):
+    setup_broadcast(monkeypatch)
+    bot = FakeBot()
+
+    async def run():
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(reminders.run_reminders({BOT_ID: bot}, stop_event))
+        await wait_for_sent(bot, 50)
+        stop_event.set()
+        await asyncio.wait_for(task, timeout=30)
+
+    asyncio.run(run())
+    assert database.get_pending_reminders() == []
+    assert_no_recipient_dropped(bot)
+
+
+def test_shutdown_timeout_saves_progress(db, monkeypatch):
+    setup_broadcast(monkeypatch)
+    first, second = FakeBot(), FakeBot()
+
+    async def run(bot, timeout):
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(reminders.run_reminders({BOT_ID: bot}, stop_event))
+        await wait_for_sent(bot, 50)
+        stop_event.set()
+        try:
+            await asyncio.wait_for(task, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # Как main.py при истечении SHUTDOWN_TIMEOUT: рассылка прервана
+    asyncio.run(run(first, 0.05))
+    assert 0 < database.get_pending_reminders()[0][6] < max(USERS)
+    # После перезапуска рассылка продолжается как пропущенная. Новый процесс -
+    # новый пул отправки, примитивы asyncio привязаны к своему циклу событий
+    monkeypatch.setattr(reminders, 'sender', Sender(concurrency=10, rate=1000))
+    asyncio.run(run(second, 30))
+    assert database.get_pending_reminders() == []
+    assert_no_recipient_dropped(first, second)